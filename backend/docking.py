@@ -1,51 +1,86 @@
 import os
+import mmap
+import shutil
 import subprocess
 
+def _resolve_cmd(configured: str, name: str):
+    """Configured path if it exists, else the first match on PATH."""
+    if os.path.isfile(configured):
+        return configured
+    return shutil.which(name)
+
 # Backend Configuration - Binary Paths
-# Using user-downloaded Vina and system Obabel
-VINA_CMD = "/Users/ragav/Downloads/vina_1.2.7_mac_aarch64"
-OBABEL_CMD = "/opt/homebrew/bin/obabel"
+# Using user-downloaded Vina and system Obabel, falling back to PATH.
+# Resolved once at import so jobs don't rescan PATH on every run.
+VINA_CMD = _resolve_cmd("/Users/ragav/Downloads/vina_1.2.7_mac_aarch64", "vina")
+OBABEL_CMD = _resolve_cmd("/opt/homebrew/bin/obabel", "obabel")
 
-def keep_first_model(input_pdb: str, output_pdb: str):
-    with open(input_pdb, "r") as f:
-        lines = f.readlines()
-    output_lines = []
+def _first_model_lines(lines):
     in_model = False
     for line in lines:
         if line.startswith("MODEL"):
             if in_model:
-                break
+                return
             in_model = True
-        if in_model or not line.startswith("MODEL"):
-            output_lines.append(line)
+        yield line
         if line.startswith("ENDMDL") and in_model:
-            break
-    with open(output_pdb, "w") as f:
-        f.writelines(output_lines)
+            return
+
+def keep_first_model(input_pdb: str, output_pdb: str):
+    # Stream line by line and stop at the end of the first model, so large
+    # NMR ensembles are never read in full; writelines drains the generator
+    # in C instead of one fo.write() call per line
+    with open(input_pdb, "r") as fi, open(output_pdb, "w") as fo:
+        fo.writelines(_first_model_lines(fi))
+
+def _wait_checked(procs):
+    """Wait for every process, then raise like subprocess.run(check=True)."""
+    for proc in procs:
+        proc.wait()
+    for proc in procs:
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
 
-def run_docking_job(receptor_pdb: str, ligand_file: str, dock_dir: str,
-                    center=(10,20,15), size=(20,20,20)):
+def run_docking_job(receptor_pdb: str, ligand_file: str, dock_dir: str, *,
+                    center=(10,20,15), size=(20,20,20), exhaustiveness=2,
+                    vina_cmd=None, obabel_cmd=None):
     """
     Prepare receptor/ligand and run AutoDock Vina.
     Returns output path and optionally parses docking scores.
+    vina_cmd/obabel_cmd default to the binaries resolved at import.
     """
+    vina_cmd = vina_cmd or VINA_CMD
+    obabel_cmd = obabel_cmd or OBABEL_CMD
+    if not (vina_cmd and obabel_cmd):
+        raise RuntimeError("Docking unavailable: AutoDock Vina and/or Open Babel not found")
+
     receptor_single = os.path.join(dock_dir, "receptor_single.pdb")
     receptor_pdbqt = os.path.join(dock_dir, "receptor.pdbqt")
     ligand_pdbqt = os.path.join(dock_dir, "ligand.pdbqt")
     out_pdbqt = os.path.join(dock_dir, "out.pdbqt")
 
-    # Step 1: keep only first model
-    keep_first_model(receptor_pdb, receptor_single)
+    # Receptor and ligand preparation are independent: launch both Obabel
+    # conversions before waiting on either, so prep takes max() not sum()
+
+    # Step 1: convert ligand to PDBQT (runs in the background)
+    ligand_proc = subprocess.Popen([obabel_cmd, ligand_file, "-O", ligand_pdbqt, "--gen3d", "--partialcharge", "gasteiger"])
+
+    try:
+        # Step 2: keep only first model
+        keep_first_model(receptor_pdb, receptor_single)
 
-    # Step 2: convert receptor to PDBQT
-    subprocess.run([OBABEL_CMD, receptor_single, "-O", receptor_pdbqt, "-xr", "--partialcharge", "gasteiger"], check=True)
+        # Step 3: convert receptor to PDBQT
+        receptor_proc = subprocess.Popen([obabel_cmd, receptor_single, "-O", receptor_pdbqt, "-xr", "--partialcharge", "gasteiger"])
+    except Exception:
+        ligand_proc.kill()
+        ligand_proc.wait()
+        raise
 
-    # Step 3: convert ligand to PDBQT
-    subprocess.run([OBABEL_CMD, ligand_file, "-O", ligand_pdbqt, "--gen3d", "--partialcharge", "gasteiger"], check=True)
+    _wait_checked([receptor_proc, ligand_proc])
 
     # Step 4: run Vina
     subprocess.run([
-        VINA_CMD,
+        vina_cmd,
         "--receptor", receptor_pdbqt,
         "--ligand", ligand_pdbqt,
         "--center_x", str(center[0]),
@@ -55,34 +90,36 @@ def run_docking_job(receptor_pdb: str, ligand_file: str, dock_dir: str,
         "--size_y", str(size[1]),
         "--size_z", str(size[2]),
         "--out", out_pdbqt,
-        "--exhaustiveness", "2"
+        "--exhaustiveness", str(exhaustiveness)
     ], check=True)
 
     # Step 5: convert out.pdbqt -> out.pdb
     out_pdb = os.path.join(dock_dir, "out.pdb")
     try:
-        subprocess.run([OBABEL_CMD, out_pdbqt, "-O", out_pdb], check=True)
+        subprocess.run([obabel_cmd, out_pdbqt, "-O", out_pdb], check=True)
     except Exception as e:
         print(f"Error converting output to PDB: {e}")
 
     # Step 6: parse scores from out.pdbqt
+    # The best pose comes first, so jump straight to the first match in the
+    # mapped file instead of iterating every line of every pose
     best_energy = 0.0
     try:
-        with open(out_pdbqt, "r") as f:
-            for line in f:
-                if "VINA RESULT:" in line: # Less strict check
-                    parts = line.split()
-                    # format: REMARK VINA RESULT:   -6.5      0.000      0.000
-                    # parts might be ['REMARK', 'VINA', 'RESULT:', '-6.5', ...]
-                    try:
-                        # Find the number after RESULT:
-                        idx = parts.index("RESULT:")
-                        if idx + 1 < len(parts):
-                            best_energy = float(parts[idx + 1])
-                            print(f"[Docking] Found best energy: {best_energy}")
-                            break
-                    except ValueError:
-                        continue
+        with open(out_pdbqt, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = mm.find(b"VINA RESULT:") # Less strict check
+            while pos != -1:
+                end = mm.find(b"\n", pos)
+                if end == -1:
+                    end = len(mm)
+                # format: REMARK VINA RESULT:   -6.5      0.000      0.000
+                # from pos, parts are [b'VINA', b'RESULT:', b'-6.5', ...]
+                parts = mm[pos:end].split()
+                try:
+                    best_energy = float(parts[2])
+                    print(f"[Docking] Found best energy: {best_energy}")
+                    break
+                except (IndexError, ValueError):
+                    pos = mm.find(b"VINA RESULT:", end)
     except Exception as e:
         print(f"Error parsing scores: {e}")
 
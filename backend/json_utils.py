@@ -0,0 +1,85 @@
+# json_utils.py
+import os, gzip, shutil, threading
+from functools import lru_cache
+import orjson
+
+# Compact output: no indent, numpy arrays/scalars encoded natively
+_DUMP_OPTS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def load_json(path):
+    """Read and parse a JSON file with orjson."""
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+@lru_cache(maxsize=128)
+def _load_json_cached(path, mtime):
+    return load_json(path)
+
+
+def load_json_cached(path):
+    """
+    Like load_json, but memoized per (path, mtime) so repeat requests skip
+    the parse. The returned object is shared: treat it as read-only.
+    """
+    return _load_json_cached(path, os.stat(path).st_mtime_ns)
+
+
+def temp_path(path, suffix=".tmp"):
+    """Per-process, per-thread scratch name next to path, for write + os.replace."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}{suffix}"
+
+
+def dump_json(path, obj):
+    """
+    Serialize obj to path with orjson.
+    Writes to a temp file first and swaps it in with os.replace, so readers
+    never see a half-written file.
+    """
+    tmp = temp_path(path)
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(obj, option=_DUMP_OPTS))
+    os.replace(tmp, path)
+
+
+def write_gzip(path, compresslevel=6):
+    """Write a gzip'd copy of path to path + '.gz' and return its path."""
+    gz_path = f"{path}.gz"
+    tmp = temp_path(gz_path)
+    with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=compresslevel) as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp, gz_path)
+    return gz_path
+
+
+def meta_path(json_path):
+    """Sidecar path holding mutable metadata for a molecule JSON."""
+    return os.path.splitext(json_path)[0] + ".meta.json"
+
+
+def load_metadata(json_path):
+    """Contents of the metadata sidecar of a molecule JSON ({} if none)."""
+    meta = meta_path(json_path)
+    return load_json(meta) if os.path.exists(meta) else {}
+
+
+def load_molecule(json_path):
+    """
+    Load a molecule JSON and merge its metadata sidecar, if any.
+    Metadata updates go to the small sidecar so the atoms array is never
+    rewritten just to flip a flag.
+    """
+    mol = load_json_cached(json_path)
+    meta = load_metadata(json_path)
+    if meta:
+        mol = {**mol, "metadata": {**mol.get("metadata", {}), **meta}}
+    return mol
+
+
+def update_metadata(json_path, **fields):
+    """Merge fields into the metadata sidecar of a molecule JSON."""
+    data = load_metadata(json_path)
+    data.update(fields)
+    dump_json(meta_path(json_path), data)
+    return data
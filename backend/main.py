@@ -1,44 +1,184 @@
-import os, uuid, json, math, asyncio
+import os, uuid, math, asyncio, sqlite3, threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+import orjson
+import msgpack
+import aiofiles
+import numpy as np
 from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 
-from pdb_utils import parse_pdb, infer_bonds, atoms_to_json, load_atoms_from_json, calculate_phi_psi, calculate_contact_map, get_sequence
-from pocket import Scientific_Pockets
-from docking import run_docking_job
-from pocket import Scientific_Pockets
+from pdb_utils import parse_pdb, infer_bonds, build_molecule_files, load_atom_index, msgpack_path, save_molecule_msgpack, calculate_phi_psi, calculate_contact_map, get_sequence
+from pocket import Scientific_Pockets, POCKETS_VERSION
 from docking import run_docking_job
+from json_utils import load_json, load_json_cached, dump_json, load_metadata, load_molecule, update_metadata
 
 BASE = "backend_jobs"
-JOBS_FILE = os.path.join(BASE, "jobs.json")
-JOBS = {}
+JOBS_FILE = os.path.join(BASE, "jobs.json")  # legacy store, migrated on startup
+JOBS_DB = os.path.join(BASE, "jobs.db")
 
 os.makedirs(BASE, exist_ok=True)
 
-def save_jobs():
-    """Save JOBS to disk."""
+# One row per job, so a mutation only rewrites that job's row. WAL lets
+# readers proceed while a write is in flight.
+_db = sqlite3.connect(JOBS_DB, check_same_thread=False)
+_db.execute("PRAGMA journal_mode=WAL")
+_db.execute("PRAGMA synchronous=NORMAL")
+_db.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, status TEXT, dir TEXT, data BLOB NOT NULL)")
+# Databases created before status/dir were broken out of the payload
+_cols = {row[1] for row in _db.execute("PRAGMA table_info(jobs)")}
+for _col in ("status", "dir"):
+    if _col not in _cols:
+        _db.execute(f"ALTER TABLE jobs ADD COLUMN {_col} TEXT")
+_db.commit()
+_db_lock = threading.Lock()
+
+def _write_job(job_id, job):
+    _db.execute(
+        "INSERT OR REPLACE INTO jobs (job_id, status, dir, data) VALUES (?, ?, ?, ?)",
+        (job_id, job.get("status"), job.get("dir"), orjson.dumps(job))
+    )
+
+def save_job(job_id):
+    """Persist a single job to disk, whole. Only for jobs no other worker can
+    have touched yet (new or migrated); changes go through update_job.
+    Returns whether the write succeeded."""
+    try:
+        with _db_lock, _db:
+            _write_job(job_id, JOBS[job_id])
+        return True
+    except Exception as e:
+        print(f"Error saving job {job_id}: {e}")
+        return False
+
+def update_job(job_id, mutate):
+    """
+    Apply mutate(job) to the stored job and persist it. The row is re-read
+    inside an IMMEDIATE transaction, so changes made by other workers since
+    this one last looked are kept rather than overwritten.
+    """
     try:
-        with open(JOBS_FILE, "w") as f:
-            json.dump(JOBS, f, indent=2)
+        with _db_lock, _db:
+            _db.execute("BEGIN IMMEDIATE")
+            row = _db.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            # dict.get: JOBS.get would re-read SQLite and take _db_lock again
+            job = orjson.loads(row[0]) if row else dict(dict.get(JOBS, job_id) or {})
+            mutate(job)
+            _write_job(job_id, job)
+        JOBS[job_id] = job
+        return job
     except Exception as e:
-        print(f"Error saving jobs: {e}")
+        print(f"Error saving job {job_id}: {e}")
+
+def _fetch_jobs(job_id=None):
+    """Rows of the jobs table as {job_id: job}: all of them, or just job_id."""
+    with _db_lock:
+        if job_id is None:
+            rows = _db.execute("SELECT job_id, data FROM jobs").fetchall()
+        else:
+            rows = _db.execute("SELECT job_id, data FROM jobs WHERE job_id = ?", (job_id,)).fetchall()
+    return {jid: orjson.loads(data) for jid, data in rows}
+
+class JobStore(dict):
+    """
+    In-memory view of the jobs table. Each uvicorn worker process has its
+    own, so lookups re-read the row from SQLite to see what other workers
+    created or changed.
+    """
+
+    def get(self, job_id, default=None):
+        self.update(_fetch_jobs(job_id))
+        return super().get(job_id, default)
+
+    def sync(self):
+        """Refresh every job from SQLite, including other workers' changes."""
+        self.update(_fetch_jobs())
+
+JOBS = JobStore()
+
+def save_jobs():
+    """Save all of JOBS to disk."""
+    for job_id in list(JOBS):
+        save_job(job_id)
 
 def load_jobs():
     """Load JOBS from disk."""
     global JOBS
-    if os.path.exists(JOBS_FILE):
-        try:
-            with open(JOBS_FILE, "r") as f:
-                JOBS = json.load(f)
-            print(f"Loaded {len(JOBS)} jobs from disk.")
-        except Exception as e:
-            print(f"Error loading jobs: {e}")
+    try:
+        JOBS = JobStore(_fetch_jobs())
+
+        # One-time migration from the old whole-file jobs.json
+        if not JOBS and os.path.exists(JOBS_FILE):
+            JOBS = JobStore(load_json(JOBS_FILE))
+            save_jobs()
+        print(f"Loaded {len(JOBS)} jobs from disk.")
+    except Exception as e:
+        print(f"Error loading jobs: {e}")
 
 # Load jobs on startup
 load_jobs()
 
-app = FastAPI(title="Proteins-EL Backend")
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered by orjson (numpy arrays/scalars included).
+    Returning an instance directly from an endpoint also skips FastAPI's
+    jsonable_encoder pass, which dominates for large atom/bond payloads.
+    """
+
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+# CPU-bound parsing/analysis runs in worker processes, so it neither blocks
+# the event loop nor serializes concurrent requests on the GIL. Under
+# run.sh every uvicorn worker has its own pool, so the cores are split
+# between them instead of each worker taking all of them
+_UVICORN_WORKERS = max(1, int(os.environ.get("BACKEND_WORKERS", "1")))
+
+def _new_pool():
+    return ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 1) // _UVICORN_WORKERS))
+
+POOL = _new_pool()
+
+async def run_in_pool(fn, *args):
+    global POOL
+    loop = asyncio.get_running_loop()
+    pool = POOL
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # A child died abruptly (OOM kill, crash in a C extension), which
+        # leaves the executor unusable for good: swap in a fresh one (unless
+        # a concurrent call already did) and retry once
+        if POOL is pool:
+            POOL = _new_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+        try:
+            return await loop.run_in_executor(POOL, fn, *args)
+        except BrokenProcessPool:
+            raise HTTPException(503, "Analysis worker crashed, try again")
+
+# Docking runs are long and mostly wait on Vina/Open Babel subprocesses, so
+# they get their own small thread pool: queued runs never starve the
+# analysis pool or the event loop
+DOCK_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="docking")
+
+# Set once a docking run has written result.json, so /wait can return as soon
+# as the run finishes instead of clients polling /result on a timer
+DOCK_EVENTS = {}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    POOL.shutdown(cancel_futures=True)
+    DOCK_POOL.shutdown(cancel_futures=True)
+
+
+app = FastAPI(title="Proteins-EL Backend", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -55,13 +195,43 @@ def _make_job():
     job_dir = os.path.join(BASE, job_id)
     os.makedirs(job_dir, exist_ok=True)
     JOBS[job_id] = {"status": "created", "dir": job_dir}
-    save_jobs()
+    if not save_job(job_id):
+        # Other workers could never see this job; fail now rather than later
+        JOBS.pop(job_id, None)
+        os.rmdir(job_dir)
+        raise HTTPException(503, "Could not create job, try again")
     return job_id, job_dir
 
 
+# Utility: is a derived file present and at least as new as its source?
+def _is_fresh(path, source):
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source)
+
+
+# Utility: run a pure per-PDB analysis once; later requests are served
+# straight from the {stem}.{name}.json it leaves next to the PDB
+async def _cached_analysis(pdb_path, name, fn):
+    cache = f"{os.path.splitext(pdb_path)[0]}.{name}.json"
+    if _is_fresh(cache, pdb_path):
+        return FileResponse(cache, media_type="application/json")
+
+    payload = {"data": await run_in_pool(fn, pdb_path)}
+    await asyncio.to_thread(dump_json, cache, payload)
+    return ORJSONResponse(payload)
+
+
+# Utility: stream an upload to disk without holding it all in memory or
+# blocking the event loop on the writes
+async def _save_upload(upload: UploadFile, path: str, chunk_size: int = 1 << 20):
+    async with aiofiles.open(path, "wb") as f:
+        while chunk := await upload.read(chunk_size):
+            await f.write(chunk)
+
+
 @app.get("/jobs")
 def list_jobs():
-    """List all jobs in memory."""
+    """List all jobs, including those created by other workers."""
+    JOBS.sync()
     job_list = []
     for jid, data in JOBS.items():
         # Extract molecule IDs if available
@@ -104,23 +274,16 @@ async def upload_pdb(file: UploadFile = File(...)):
     pdb_id = os.path.splitext(file.filename)[0]
     pdb_path = os.path.join(job_dir, file.filename)
 
-    with open(pdb_path, "wb") as f:
-        f.write(await file.read())
+    await _save_upload(file, pdb_path)
 
-    atoms = parse_pdb(pdb_path)
-    bonds = infer_bonds(atoms)
-    mol_json = atoms_to_json(pdb_id, atoms, bonds)
     json_path = os.path.join(job_dir, f"{pdb_id}.json")
+    await run_in_pool(build_molecule_files, pdb_path, json_path, pdb_id)
 
-    with open(json_path, "w") as jf:
-        json.dump(mol_json, jf, indent=2)
-
-    JOBS[job_id] = {
-        "status": "ready",
-        "dir": job_dir,
-        "molecules": {pdb_id: json_path}
-    }
-    save_jobs()
+    def mark_ready(job):
+        job["status"] = "ready"
+        job["dir"] = job_dir
+        job.setdefault("molecules", {})[pdb_id] = json_path
+    update_job(job_id, mark_ready)
 
     return {
         "job_id": job_id,
@@ -129,8 +292,37 @@ async def upload_pdb(file: UploadFile = File(...)):
     }
 
 
+# Registered before the JSON route so "{pdb_id}.msgpack" is not read as a pdb_id
+@app.get("/job/{job_id}/molecule/{pdb_id}.msgpack")
+def get_molecule_msgpack(job_id: str, pdb_id: str):
+    job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+
+    json_path = os.path.join(job["dir"], f"{pdb_id}.json")
+    if not os.path.exists(json_path):
+        raise HTTPException(404, "Molecule not found")
+
+    path = msgpack_path(json_path)
+    if not os.path.exists(path):
+        # Jobs uploaded before the binary format existed
+        mol = load_json_cached(json_path)
+        save_molecule_msgpack(json_path, pdb_id, mol["atoms"], mol["bonds"])
+
+    # Flags set after upload (e.g. by /preprocess) live in the metadata
+    # sidecar, so the prebuilt file can only be served as-is without one
+    meta = load_metadata(json_path)
+    if meta:
+        with open(path, "rb") as f:
+            payload = msgpack.unpackb(f.read())
+        payload["metadata"] = meta
+        return Response(msgpack.packb(payload, use_bin_type=True), media_type="application/msgpack")
+
+    return FileResponse(path, media_type="application/msgpack")
+
+
 @app.get("/job/{job_id}/molecule/{pdb_id}")
-def get_molecule(job_id: str, pdb_id: str):
+def get_molecule(job_id: str, pdb_id: str, request: Request):
     job = JOBS.get(job_id)
     if not job:
         raise HTTPException(404, "Job not found")
@@ -139,7 +331,25 @@ def get_molecule(job_id: str, pdb_id: str):
     if not os.path.exists(path):
         raise HTTPException(404, "Molecule not found")
 
-    return FileResponse(path)
+    # Flags set after upload (e.g. by /preprocess) live in the metadata
+    # sidecar; merge them in rather than serving the prebuilt files
+    if load_metadata(path):
+        return ORJSONResponse(load_molecule(path), headers={"Vary": "Accept-Encoding"})
+
+    # Serve the copy compressed at upload time when the client accepts it
+    gz_path = f"{path}.gz"
+    if (
+        "gzip" in request.headers.get("accept-encoding", "")
+        and os.path.exists(gz_path)
+        and os.path.getmtime(gz_path) >= os.path.getmtime(path)
+    ):
+        return FileResponse(
+            gz_path,
+            media_type="application/json",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        )
+
+    return FileResponse(path, headers={"Vary": "Accept-Encoding"})
 
 
 # ---------------------------
@@ -159,16 +369,7 @@ def preprocess(
     if not os.path.exists(json_path):
         raise HTTPException(404, "Molecule not found")
 
-    with open(json_path) as f:
-        mol = json.load(f)
-
-    mol.setdefault("metadata", {})["preprocessed"] = True
-
-    with open(json_path, "w") as f:
-        json.dump(mol, f, indent=2)
-    
-    # Update job status/metadata if needed and save
-    save_jobs()
+    update_metadata(json_path, preprocessed=True)
 
     return {"status": "preprocessed", "pdb_id": pdb_id}
 
@@ -177,7 +378,7 @@ def preprocess(
 # Phase 3: Pocket Detection
 # ---------------------------
 @app.post("/job/{job_id}/detect_pockets")
-def detect(job_id: str, pdb_id: str = Form(...)):
+async def detect(job_id: str, pdb_id: str = Form(...)):
     job = JOBS.get(job_id)
     if not job:
         raise HTTPException(404, "Job not found")
@@ -187,36 +388,25 @@ def detect(job_id: str, pdb_id: str = Form(...)):
     if not os.path.exists(json_path):
         raise HTTPException(404, "Molecule JSON not found")
 
-    with open(json_path) as f:
-        mol = json.load(f)
-
-    # --- Validate atom fields for Scientific_Pockets() ---
-    cleaned_atoms = []
-    for atom in mol.get("atoms", []):
-        cleaned_atoms.append({
-            "x": float(atom.get("x", 0)),
-            "y": float(atom.get("y", 0)),
-            "z": float(atom.get("z", 0)),
-            "chain": atom.get("chain", "_"),
-            "resseq": int(atom.get("resseq", 0)),
-            "resname": atom.get("resname", "UNK"),
-        })
-
-    mol["atoms"] = cleaned_atoms
+    # Detection is a pure function of the molecule: reuse a saved result.
+    # The name carries the algorithm version, so .pockets.json files left by
+    # older releases (wrong residues/hydrophobicity) are never picked up
+    out = os.path.join(job["dir"], f"{pdb_id}.pockets.v{POCKETS_VERSION}.json")
+    if _is_fresh(out, json_path):
+        return FileResponse(out, media_type="application/json")
 
-    # --- Run scientific pocket detection ---
+    # --- Run scientific pocket detection in a worker process ---
+    # Scientific_Pockets() reads the SoA arrays from the .npz sidecar
     try:
-        result = Scientific_Pockets(mol)
+        result = await run_in_pool(Scientific_Pockets, json_path)
     except Exception as e:
         raise HTTPException(500, f"Pocket detection failed: {str(e)}")
 
-    # Save result
-    out = os.path.join(job["dir"], f"{pdb_id}.pockets.json")
-    with open(out, "w") as f:
-        json.dump(result, f, indent=2)
+    # Save result; the unversioned name is still written for external readers
+    await asyncio.to_thread(dump_json, out, result)
+    await asyncio.to_thread(dump_json, os.path.join(job["dir"], f"{pdb_id}.pockets.json"), result)
 
-    save_jobs()
-    return result
+    return ORJSONResponse(result)
 
 # ---------------------------
 # Phase 4: Bond Energy LJ
@@ -228,22 +418,22 @@ def bond_energy(job_id: str, pdb_id: str, a_idx: int, b_idx: int):
         raise HTTPException(404, "Job not found")
 
     json_path = os.path.join(job["dir"], f"{pdb_id}.json")
-    atoms = load_atoms_from_json(json_path)
+    soa, pos = load_atom_index(json_path)
 
-    A = next((x for x in atoms if x["index"] == a_idx), None)
-    B = next((x for x in atoms if x["index"] == b_idx), None)
+    ia = pos.get(a_idx)
+    ib = pos.get(b_idx)
 
-    if not A or not B:
+    if ia is None or ib is None:
         raise HTTPException(404, "Atom not found")
 
-    dx = A["x"] - B["x"]
-    dy = A["y"] - B["y"]
-    dz = A["z"] - B["z"]
+    dx, dy, dz = (soa["xyz"][ia].astype(np.float64) - soa["xyz"][ib]).tolist()
 
     r = math.sqrt(dx*dx + dy*dy + dz*dz)
     inv = 1 / max(r, 1e-6)
 
-    lj = 4 * ((inv**12) - (inv**6))
+    inv6 = inv * inv * inv
+    inv6 *= inv6
+    lj = 4 * (inv6 * inv6 - inv6)
     feasible = r < 1.9
 
     return {
@@ -274,12 +464,12 @@ async def start_docking(
         raise HTTPException(404, f"Receptor PDB not found: {receptor_pdb}")
 
     ligand_path = os.path.join(job_dir, ligand_file.filename)
-    with open(ligand_path, "wb") as f:
-        f.write(await ligand_file.read())
+    await _save_upload(ligand_file, ligand_path)
 
     dock_id = uuid.uuid4().hex[:8]
     dock_dir = os.path.join(job_dir, "docking", dock_id)
     os.makedirs(dock_dir, exist_ok=True)
+    DOCK_EVENTS[dock_id] = asyncio.Event()
 
     async def run():
         try:
@@ -289,7 +479,7 @@ async def start_docking(
 
             if pocket_data:
                 try:
-                    p = json.loads(pocket_data)
+                    p = orjson.loads(pocket_data)
                     if "center" in p:
                         c = p["center"]
                         center = (c[0], c[1], c[2])
@@ -306,7 +496,19 @@ async def start_docking(
                 except Exception as e:
                     print(f"Error parsing pocket data: {e}")
 
-            result = run_docking_job(receptor_pdb, ligand_path, dock_dir, center=center, size=size)
+            def dock():
+                result = run_docking_job(receptor_pdb, ligand_path, dock_dir, center=center, size=size)
+
+                # Precompute the receptor + ligand view served by /molecule
+                if result.get("output_pdb"):
+                    try:
+                        merged = _merge_docked_structure(receptor_pdb, result["output_pdb"])
+                        dump_json(os.path.join(dock_dir, "merged.json"), merged)
+                    except Exception as e:
+                        print(f"Error precomputing docked structure: {e}")
+                return result
+
+            result = await asyncio.get_running_loop().run_in_executor(DOCK_POOL, dock)
             
             # Save result to file for endpoint to pick up
             result_data = {
@@ -314,28 +516,28 @@ async def start_docking(
                 "status": "done",
                 **result
             }
-            with open(os.path.join(dock_dir, "result.json"), "w") as f:
-                json.dump(result_data, f, indent=2)
+            dump_json(os.path.join(dock_dir, "result.json"), result_data)
 
-            job.setdefault("docking", {})[dock_id] = {
+            entry = {
                 "status": "done",
                 "result": result
             }
-            save_jobs()
+            update_job(job_id, lambda j: j.setdefault("docking", {}).update({dock_id: entry}))
         except Exception as e:
             error_data = {
                 "docking_id": dock_id,
                 "status": "error",
                 "error": str(e)
             }
-            with open(os.path.join(dock_dir, "result.json"), "w") as f:
-                json.dump(error_data, f, indent=2)
+            dump_json(os.path.join(dock_dir, "result.json"), error_data)
 
-            job.setdefault("docking", {})[dock_id] = {
+            entry = {
                 "status": "error",
                 "error": str(e)
             }
-            save_jobs()
+            update_job(job_id, lambda j: j.setdefault("docking", {}).update({dock_id: entry}))
+        finally:
+            DOCK_EVENTS.pop(dock_id).set()
 
     asyncio.create_task(run())
 
@@ -353,6 +555,91 @@ def docking_result(job_id: str, dock_id: str):
     return FileResponse(path)
 
 
+@app.get("/job/{job_id}/docking/{dock_id}/wait")
+async def docking_wait(job_id: str, dock_id: str, timeout: float = Query(60.0, ge=0, le=300)):
+    """
+    Long-poll variant of /result: blocks until the run finishes or timeout.
+    A run still going at the timeout answers 202 {"status": "pending"}, so
+    clients can tell it apart from a missing job/run (404) and wait again.
+    """
+    job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+
+    dock_dir = os.path.join(job["dir"], "docking", dock_id)
+    if not os.path.isdir(dock_dir):
+        raise HTTPException(404, "Docking run not found")
+
+    path = os.path.join(dock_dir, "result.json")
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not os.path.exists(path):
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            return ORJSONResponse({"docking_id": dock_id, "status": "pending"}, status_code=202)
+        event = DOCK_EVENTS.get(dock_id)
+        try:
+            # Runs started by another worker process have no local event,
+            # so fall back to a short re-check interval for those
+            await asyncio.wait_for(event.wait() if event else asyncio.sleep(0.25), remaining)
+        except asyncio.TimeoutError:
+            pass
+
+    return FileResponse(path)
+
+
+def _merge_docked_structure(receptor_path, out_pdb):
+    """Receptor + docked ligand poses as one {atoms, bonds} molecule."""
+    # Parse ligand (docking output)
+    ligand_atoms_all = parse_pdb(out_pdb)
+
+    # parse_pdb flattens every model, so all poses come back sequentially.
+    # Showing all poses lets the user see the cluster, so keep them all.
+    ligand_atoms = ligand_atoms_all
+    # If we have receptor, merge
+    combined_atoms = []
+    combined_bonds = []
+
+    if receptor_path:
+        try:
+            print(f"[DockingMolecule] Loading receptor from {receptor_path}")
+            receptor_atoms = parse_pdb(receptor_path)
+            combined_atoms.extend(receptor_atoms)
+
+            # Infer bonds for receptor
+            receptor_bonds = infer_bonds(receptor_atoms)
+            combined_bonds.extend(receptor_bonds)
+
+            offset = len(combined_atoms) # Offset is current length (receptor count)
+
+            for atom in ligand_atoms:
+                new_atom = atom.copy()
+                new_atom["index"] = offset + atom["index"] # Shift index to be unique
+                new_atom["chain"] = "L" # Force ligand chain
+                combined_atoms.append(new_atom)
+
+            # Bonds for ligand
+            ligand_bonds = infer_bonds(ligand_atoms)
+            for b in ligand_bonds:
+                combined_bonds.append({
+                    "a": b["a"] + offset,
+                    "b": b["b"] + offset,
+                    "dist": b["dist"]
+                })
+        except Exception as e:
+            print(f"Error merging receptor: {e}")
+            # Fallback to just ligand
+            combined_atoms = ligand_atoms
+            combined_bonds = infer_bonds(ligand_atoms)
+    else:
+         combined_atoms = ligand_atoms
+         combined_bonds = infer_bonds(ligand_atoms)
+
+    return {
+        "atoms": combined_atoms,
+        "bonds": combined_bonds
+    }
+
+
 @app.get("/job/{job_id}/docking/{docking_id}/molecule")
 def docking_molecule(job_id: str, docking_id: str):
     job = JOBS.get(job_id)
@@ -361,6 +648,14 @@ def docking_molecule(job_id: str, docking_id: str):
 
     dock_dir = os.path.join(job["dir"], "docking", docking_id)
     out_pdb = os.path.join(dock_dir, "out.pdb")
+    merged_path = os.path.join(dock_dir, "merged.json")
+
+    # Normally precomputed when the docking job finishes
+    if os.path.exists(merged_path):
+        return FileResponse(merged_path)
+
+    if not os.path.exists(out_pdb):
+        raise HTTPException(404, "Docking output not found")
 
     # Try to find the specific PDB file for this job
     # We uploaded it as {pdb_id}.pdb
@@ -373,86 +668,11 @@ def docking_molecule(job_id: str, docking_id: str):
         receptor_path = expected_pdb
     elif files:
         receptor_path = os.path.join(job["dir"], files[0])
-    
-    if not os.path.exists(out_pdb):
-        raise HTTPException(404, "Docking output not found")
-        
-    try:
-        # Parse ligand (docking output)
-        ligand_atoms_all = parse_pdb(out_pdb)
-        
-        # Filter for just the first model (assuming parse_pdb returns all models sequentially)
-        # We can detect model breaks if residue numbers reset or similar, but for now, 
-        # let's just take the first N atoms where N is atoms per model?
-        # A safer way with the current parse_pdb (which flattens everything) is tricky.
-        # But actually, showing *all* poses is kind of cool? Let's keep all poses for now.
-        # Or, just show the best pose (first one).
-        # Typically the first X atoms correspond to the first model.
-        # Let's count atoms in first model from the file content to be safe?
-        # For simplicity, let's just use all of them, but separate them visually?
-        # No, that will look messy.
-        # Let's try to infer if there are duplicates.
-        
-        ligand_atoms = ligand_atoms_all
-        # If we have receptor, merge
-        combined_atoms = []
-        combined_bonds = []
-        
-        if receptor_path:
-            try:
-                print(f"[DockingMolecule] Loading receptor from {receptor_path}")
-                receptor_atoms = parse_pdb(receptor_path)
-                combined_atoms.extend(receptor_atoms)
-                
-                # Infer bonds for receptor
-                receptor_bonds = infer_bonds(receptor_atoms)
-                combined_bonds.extend(receptor_bonds)
-
-                offset = len(combined_atoms) # Offset is current length (receptor count)
-                
-                # Taking ONLY the first model of ligand if possible. 
-                # If ligand_atoms_all has multiple models, they satisfy: same atom names repeated.
-                # Let's just take the first occurrence of atoms?
-                # Simple heuristic: Identify by atom index. in PDBQT, indices reset or continue?
-                # In the out.pdb, atoms are numbered 1..N for each MODEL.
-                # parse_pdb re-indexes them 1..Total?
-                # Let's check parse_pdb implementation in mind... it increments i=1.
-                # So we just get a long list. 
-                # Let's just slice the first model?
-                # How many atoms in one model?
-                # Logic: The ligand usually doesn't change atom count.
-                # We can check if atom index 1 appears multiple times?
-                # parse_pdb assigns its own index.
-                # Let's check if 'resseq' resets? no.
-                # Let's just SHOW ALL poses for now, as the user might want to see the cluster.
-                
-                for atom in ligand_atoms:
-                    new_atom = atom.copy()
-                    new_atom["index"] = offset + atom["index"] # Shift index to be unique
-                    new_atom["chain"] = "L" # Force ligand chain
-                    combined_atoms.append(new_atom)
-                
-                # Bonds for ligand
-                ligand_bonds = infer_bonds(ligand_atoms)
-                for b in ligand_bonds:
-                    combined_bonds.append({
-                        "a": b["a"] + offset,
-                        "b": b["b"] + offset,
-                        "dist": b["dist"]
-                    })
-            except Exception as e:
-                print(f"Error merging receptor: {e}")
-                # Fallback to just ligand
-                combined_atoms = ligand_atoms
-                combined_bonds = infer_bonds(ligand_atoms)
-        else:
-             combined_atoms = ligand_atoms
-             combined_bonds = infer_bonds(ligand_atoms)
 
-        return {
-            "atoms": combined_atoms,
-            "bonds": combined_bonds
-        }
+    try:
+        merged = _merge_docked_structure(receptor_path, out_pdb)
+        dump_json(merged_path, merged)
+        return ORJSONResponse(merged)
     except Exception as e:
         print(f"Error parsing docked structure: {e}")
         raise HTTPException(500, f"Failed to parse docked structure: {e}")
@@ -463,7 +683,7 @@ def docking_molecule(job_id: str, docking_id: str):
 # ---------------------------
 
 @app.get("/job/{job_id}/analysis/ramachandran")
-def ramachandran(job_id: str, pdb_id: str):
+async def ramachandran(job_id: str, pdb_id: str):
     job = JOBS.get(job_id)
     if not job:
         raise HTTPException(404, "Job not found")
@@ -484,14 +704,13 @@ def ramachandran(job_id: str, pdb_id: str):
         pdb_path = os.path.join(job["dir"], files[0])
 
     try:
-        data = calculate_phi_psi(pdb_path)
-        return {"data": data}
+        return await _cached_analysis(pdb_path, "ramachandran", calculate_phi_psi)
     except Exception as e:
         raise HTTPException(500, f"Analysis failed: {str(e)}")
 
 
 @app.get("/job/{job_id}/analysis/contact_map")
-def contact_map(job_id: str, pdb_id: str):
+async def contact_map(job_id: str, pdb_id: str):
     job = JOBS.get(job_id)
     if not job:
         raise HTTPException(404, "Job not found")
@@ -504,14 +723,13 @@ def contact_map(job_id: str, pdb_id: str):
         pdb_path = os.path.join(job["dir"], files[0])
 
     try:
-        data = calculate_contact_map(pdb_path)
-        return {"data": data}
+        return await _cached_analysis(pdb_path, "contact_map", calculate_contact_map)
     except Exception as e:
         raise HTTPException(500, f"Analysis failed: {str(e)}")
 
 
 @app.get("/job/{job_id}/analysis/sequence")
-def sequence(job_id: str, pdb_id: str):
+async def sequence(job_id: str, pdb_id: str):
     job = JOBS.get(job_id)
     if not job:
         raise HTTPException(404, "Job not found")
@@ -524,7 +742,6 @@ def sequence(job_id: str, pdb_id: str):
         pdb_path = os.path.join(job["dir"], files[0])
 
     try:
-        data = get_sequence(pdb_path)
-        return {"data": data}
+        return await _cached_analysis(pdb_path, "sequence", get_sequence)
     except Exception as e:
         raise HTTPException(500, f"Analysis failed: {str(e)}")
\ No newline at end of file
@@ -1,6 +1,12 @@
-import math
+import os
+from functools import lru_cache
 import numpy as np
+import msgpack
+from scipy.spatial import cKDTree
 from Bio.PDB import PDBParser, PPBuilder
+from Bio.Data.IUPACData import atom_weights
+
+from json_utils import load_json, dump_json, write_gzip, temp_path
 
 three_to_one = {
     'ALA': 'A', 'CYS': 'C', 'ASP': 'D', 'GLU': 'E',
@@ -10,79 +16,312 @@ three_to_one = {
     'THR': 'T', 'VAL': 'V', 'TRP': 'W', 'TYR': 'Y'
 }
 
-def parse_pdb(path):
+@lru_cache(maxsize=32)
+def _load_structure(path, mtime):
     parser = PDBParser(QUIET=True)
-    structure = parser.get_structure("prot", path)
+    return parser.get_structure("prot", path)
+
+
+def load_structure(path):
+    """Bio.PDB Structure for path, memoized per (path, mtime). Treat as read-only."""
+    return _load_structure(path, os.stat(path).st_mtime_ns)
+
+
+class _UnsupportedPDB(Exception):
+    """Raised by fast_parse_pdb for layouts it leaves to Bio.PDB."""
+
+
+def _assign_element(element, name, fullname):
+    # Same rules as Bio.PDB.Atom._assign_element
+    if element and element.capitalize() in atom_weights:
+        return element
+    if fullname[0].isalpha() and not fullname[2:].isdigit():
+        guess = name.strip()
+    elif name[0].isdigit():
+        guess = name[1]
+    else:
+        guess = name[0]
+    return guess if guess.capitalize() in atom_weights else "X"
+
+
+def fast_parse_pdb(path):
+    """
+    Fixed-width ATOM/HETATM reader returning SoA columns (see atoms_to_arrays).
+    Follows PDBParser's model/chain/residue grouping and altloc selection
+    (highest occupancy, first one on ties), so the atoms come out exactly as
+    a walk over the Bio.PDB structure would give them. Raises _UnsupportedPDB
+    for the rare layouts it does not model (point mutations, re-used hetero
+    residue ids, blank-then-lettered altlocs, names differing only in spaces).
+    """
+    models = []     # per model: {chain_id: {res_id: [resname, {name: atom}]}}
+    model = chain = residue = None
+    chain_id = res_key = None
+    started = False
+
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            record = line[0:6]
+            if not started:
+                # Everything before the first coordinate record is header
+                if record not in ("ATOM  ", "HETATM", "MODEL "):
+                    continue
+                started = True
+            if not line.strip():
+                continue
 
-    atoms = []
-    i = 1
+            if record == "ATOM  " or record == "HETATM":
+                if model is None:
+                    model = {}
+                    models.append(model)
+
+                fullname = line[12:16]
+                parts = fullname.split()
+                name = parts[0] if len(parts) == 1 else fullname
+                altloc = line[16]
+                resname = line[17:20].strip()
+                if record == "HETATM":
+                    field = "W" if resname in ("HOH", "WAT") else "H_" + resname
+                else:
+                    field = " "
+                res_id = (field, int(line[22:26].split()[0]), line[26])
+                xyz = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+                try:
+                    occupancy = float(line[54:60])
+                except ValueError:
+                    occupancy = None
+                try:
+                    b_factor = float(line[60:66])
+                except ValueError:
+                    b_factor = 0.0
+
+                if line[21] != chain_id:
+                    chain_id = line[21]
+                    chain = model.setdefault(chain_id, {})
+                    res_key = None
+                if (res_id, resname) != res_key:
+                    res_key = (res_id, resname)
+                    residue = chain.get(res_id)
+                    if residue is None:
+                        residue = chain[res_id] = [resname, {}]
+                    elif field != " " or residue[0] != resname:
+                        raise _UnsupportedPDB("duplicate residue id")
+
+                atoms = residue[1]
+                dup = atoms.get(name)
+                if dup is not None and dup["fullname"] != fullname:
+                    raise _UnsupportedPDB("atom names differ only in spaces")
+                atom = {
+                    "fullname": fullname,
+                    "xyz": xyz,
+                    "b_factor": b_factor,
+                    "element": line[76:78].strip().upper(),
+                    "occupancy": occupancy,
+                    "disordered": altloc != " ",
+                }
+                if altloc == " ":
+                    # A second blank-altloc copy of an atom is dropped
+                    if dup is None:
+                        atoms[name] = atom
+                elif dup is None:
+                    atoms[name] = atom
+                elif not dup["disordered"]:
+                    raise _UnsupportedPDB("disordered atom with blank altloc")
+                elif occupancy > dup["occupancy"]:
+                    atoms[name] = atom
+
+            elif record == "MODEL ":
+                model = {}
+                models.append(model)
+                chain_id = res_key = None
+            elif record == "ENDMDL":
+                model = None
+                chain_id = res_key = None
+            elif record == "END   " or record == "CONECT":
+                break
+
+    coords, elements, names = [], [], []
+    residue_names, residue_numbers, chain_ids, b_factors = [], [], [], []
+
+    for model in models:
+        for chain_id, chain in model.items():
+            for res_id, (res_name, atoms) in chain.items():
+                for name, atom in atoms.items():
+                    coords.append(atom["xyz"])
+                    elements.append(_assign_element(atom["element"], name, atom["fullname"]))
+                    names.append(name)
+                    residue_names.append(res_name)
+                    residue_numbers.append(res_id[1])
+                    chain_ids.append(chain_id)
+                    b_factors.append(atom["b_factor"])
+
+    return _atom_columns(coords, elements, names, residue_names, residue_numbers, chain_ids, b_factors)
+
+
+def _parse_pdb_arrays_bio(path):
+    structure = load_structure(path)
+
+    coords, elements, names = [], [], []
+    residue_names, residue_numbers, chain_ids, b_factors = [], [], [], []
 
     for model in structure:
         for chain in model:
+            chain_id = chain.get_id()
             for residue in chain:
                 res_name = residue.get_resname()
                 res_num = residue.get_id()[1]
-                
+
                 for atom in residue:
-                    element = atom.element if atom.element else atom.get_name()[0]
-                    atoms.append({
-                        "index": i,
-                        "element": element,
-                        "name": atom.get_name(),
-                        "residue_name": res_name,
-                        "residue_number": res_num,
-                        "chain_id": chain.get_id(),
-                        "b_factor": atom.get_bfactor(),
-                        "x": float(atom.coord[0]),
-                        "y": float(atom.coord[1]),
-                        "z": float(atom.coord[2])
-                    })
-                    i += 1
-
-    return atoms
+                    name = atom.get_name()
+                    coords.append(atom.coord)
+                    elements.append(atom.element if atom.element else name[0])
+                    names.append(name)
+                    residue_names.append(res_name)
+                    residue_numbers.append(res_num)
+                    chain_ids.append(chain_id)
+                    b_factors.append(atom.get_bfactor())
+
+    return _atom_columns(coords, elements, names, residue_names, residue_numbers, chain_ids, b_factors)
+
+
+def parse_pdb_arrays(path):
+    """Atoms of every model as SoA columns (see atoms_to_arrays), index from 1."""
+    try:
+        return fast_parse_pdb(path)
+    except (_UnsupportedPDB, ValueError, IndexError, TypeError):
+        # Unusual layout or malformed record: let Bio.PDB handle (or report) it
+        return _parse_pdb_arrays_bio(path)
+
+
+def _atom_columns(coords, elements, names, residue_names, residue_numbers, chain_ids, b_factors):
+    n = len(names)
+    return {
+        "index": np.arange(1, n + 1, dtype=np.int32),
+        "xyz": np.array(coords, dtype=np.float32).reshape(-1, 3),
+        "element": np.array(elements, dtype=str),
+        "name": np.array(names, dtype=str),
+        "residue_name": np.array(residue_names, dtype=str),
+        "residue_number": np.array(residue_numbers, dtype=np.int32),
+        "chain_id": np.array(chain_ids, dtype=str),
+        "b_factor": np.array(b_factors, dtype=np.float64),
+    }
+
+
+class AtomsView:
+    """Read-only per-atom dict view over SoA arrays, for code that wants a["x"]."""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.arrays["index"])
+
+    def __getitem__(self, i):
+        a = self.arrays
+        x, y, z = a["xyz"][i].tolist()
+        atom = {
+            "index": int(a["index"][i]),
+            "element": str(a["element"][i]),
+            "name": str(a["name"][i]),
+            "residue_name": str(a["residue_name"][i]),
+            "residue_number": int(a["residue_number"][i]),
+            "chain_id": str(a["chain_id"][i]),
+        }
+        if "b_factor" in a:
+            atom["b_factor"] = float(a["b_factor"][i])
+        atom.update(x=x, y=y, z=z)
+        return atom
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def to_list(self):
+        """All atoms as dicts (the molecule JSON layout), built column-wise."""
+        a = self.arrays
+        n = len(self)
+        xyz = a["xyz"].tolist()
+        b_factor = a["b_factor"].tolist() if "b_factor" in a else None
+        columns = [a[k].tolist() for k in ("index", "element", "name", "residue_name", "residue_number", "chain_id")]
+        atoms = []
+        for i, (idx, element, name, res_name, res_num, chain_id) in enumerate(zip(*columns)):
+            atom = {
+                "index": idx,
+                "element": element,
+                "name": name,
+                "residue_name": res_name,
+                "residue_number": res_num,
+                "chain_id": chain_id,
+            }
+            if b_factor is not None:
+                atom["b_factor"] = b_factor[i]
+            atom["x"], atom["y"], atom["z"] = xyz[i]
+            atoms.append(atom)
+        return atoms
+
+
+def parse_pdb(path):
+    return AtomsView(parse_pdb_arrays(path)).to_list()
 
 
 def infer_bonds(atoms, threshold=1.9):
+    """Bonds for a list of atom dicts or SoA arrays (see atoms_to_arrays)."""
     bonds = []
-    # Optimization: Only check atoms within reasonable index range or use spatial hash
-    # For now, simple optimization: only check atoms in same or adjacent residues
-    
-    # Pre-group by residue
-    residues = {}
-    for a in atoms:
-        key = (a["chain_id"], a["residue_number"])
-        if key not in residues:
-            residues[key] = []
-        residues[key].append(a)
-        
-    sorted_keys = sorted(residues.keys(), key=lambda x: (x[0], x[1]))
-    
-    for idx, key in enumerate(sorted_keys):
-        # Check within residue
-        curr_atoms = residues[key]
-        for i in range(len(curr_atoms)):
-            for j in range(i + 1, len(curr_atoms)):
-                a = curr_atoms[i]
-                b = curr_atoms[j]
-                dist = math.sqrt((a["x"]-b["x"])**2 + (a["y"]-b["y"])**2 + (a["z"]-b["z"])**2)
-                if dist < threshold:
-                    bonds.append({"a": a["index"], "b": b["index"], "dist": dist})
-        
-        # Check with next residue (peptide bond)
-        if idx < len(sorted_keys) - 1:
-            next_key = sorted_keys[idx+1]
-            # Only if same chain and sequential
-            if key[0] == next_key[0] and next_key[1] == key[1] + 1:
-                next_atoms = residues[next_key]
-                # Usually C of curr connects to N of next
-                c_atom = next((x for x in curr_atoms if x["name"] == "C"), None)
-                n_atom = next((x for x in next_atoms if x["name"] == "N"), None)
-                if c_atom and n_atom:
-                    dist = math.sqrt((c_atom["x"]-n_atom["x"])**2 + (c_atom["y"]-n_atom["y"])**2 + (c_atom["z"]-n_atom["z"])**2)
-                    if dist < 2.0: # Peptide bond is approx 1.33A
-                         bonds.append({"a": c_atom["index"], "b": n_atom["index"], "dist": dist})
-
-    return bonds
+    if not len(atoms):
+        return bonds
+    arrays = atoms if isinstance(atoms, dict) else atoms_to_arrays(atoms)
+    # Only atoms in the same residue (or C-N of adjacent residues) can bond
+
+    # Rank residues by (chain, number)
+    res_keys = list(zip(arrays["chain_id"].tolist(), arrays["residue_number"].tolist()))
+    sorted_keys = sorted(set(res_keys))
+    rank = {key: r for r, key in enumerate(sorted_keys)}
+
+    # Within-residue candidates: one KD-tree cutoff query over all atoms,
+    # then drop pairs that straddle two residues
+    res_rank = np.fromiter((rank[k] for k in res_keys), dtype=np.int64, count=len(res_keys))
+    xyz = arrays["xyz"].astype(np.float64)
+    pairs = cKDTree(xyz).query_pairs(r=threshold, output_type="ndarray")
+    pairs = pairs[res_rank[pairs[:, 0]] == res_rank[pairs[:, 1]]]
+    # Compare squared distances; only the survivors pay for the sqrt
+    diff = xyz[pairs[:, 0]] - xyz[pairs[:, 1]]
+    diff *= diff
+    d2 = diff[:, 0] + diff[:, 1] + diff[:, 2]
+    keep = d2 < threshold * threshold
+    pairs, dists = pairs[keep], np.sqrt(d2[keep])
+
+    # First C and first N atom of each residue (-1 if absent)
+    def first_named(name):
+        rows = np.nonzero(arrays["name"] == name)[0]
+        ranks, first = np.unique(res_rank[rows], return_index=True)
+        out = np.full(len(sorted_keys), -1, dtype=np.int64)
+        out[ranks] = rows[first]
+        return out
+
+    # Peptide bonds: C of each residue to N of the next one, when that is
+    # the same chain and sequential, all residue pairs at once
+    key_chain = np.array([k[0] for k in sorted_keys])
+    key_num = np.array([k[1] for k in sorted_keys])
+    pep = np.nonzero((key_chain[:-1] == key_chain[1:]) & (key_num[1:] == key_num[:-1] + 1))[0]
+    c, n = first_named("C")[pep], first_named("N")[pep + 1]
+    found = (c >= 0) & (n >= 0)
+    pep, c, n = pep[found], c[found], n[found]
+    diff = xyz[c] - xyz[n]
+    diff *= diff
+    pep_dists = np.sqrt(diff[:, 0] + diff[:, 1] + diff[:, 2])
+    close = pep_dists < 2.0 # Peptide bond is approx 1.33A
+    pep, c, n, pep_dists = pep[close], c[close], n[close], pep_dists[close]
+
+    # Emit per residue: its own bonds by (i, j), then its peptide bond
+    all_pairs = np.concatenate([pairs, np.stack([c, n], axis=1)])
+    all_dists = np.concatenate([dists, pep_dists])
+    rank = np.concatenate([res_rank[pairs[:, 0]], pep])
+    kind = np.concatenate([np.zeros(len(pairs), dtype=np.int8), np.ones(len(pep), dtype=np.int8)])
+    order = np.lexsort((all_pairs[:, 1], all_pairs[:, 0], kind, rank))
+
+    index = arrays["index"]
+    a_idx = index[all_pairs[order, 0]].tolist()
+    b_idx = index[all_pairs[order, 1]].tolist()
+    return [{"a": a, "b": b, "dist": d} for a, b, d in zip(a_idx, b_idx, all_dists[order].tolist())]
 
 
 def atoms_to_json(pdb_id, atoms, bonds, metadata=None):
@@ -95,68 +334,175 @@ def atoms_to_json(pdb_id, atoms, bonds, metadata=None):
 
 
 def load_atoms_from_json(path):
-    import json
-    with open(path) as f:
-        return json.load(f)["atoms"]
+    return load_json(path)["atoms"]
+
+
+def build_molecule_files(pdb_path, json_path, pdb_id):
+    """
+    Parse pdb_path and write every per-molecule file next to json_path:
+    the JSON (+ .gz), the .npz arrays and the .msgpack wire format.
+    Module-level so it can run in a worker process.
+    """
+    arrays = parse_pdb_arrays(pdb_path)
+    bonds = infer_bonds(arrays)
+    dump_json(json_path, atoms_to_json(pdb_id, AtomsView(arrays).to_list(), bonds))
+    write_gzip(json_path)
+    save_atom_arrays(json_path, arrays)
+    save_molecule_msgpack(json_path, pdb_id, arrays, bonds)
+
+
+# Column-wise (SoA) copy of a molecule's atoms, stored as {pdb_id}.npz next
+# to the JSON. The numeric endpoints read these arrays instead of walking
+# the per-atom dicts.
+def atoms_to_arrays(atoms):
+    return {
+        "index": np.array([a["index"] for a in atoms], dtype=np.int32),
+        "xyz": np.array([(a["x"], a["y"], a["z"]) for a in atoms], dtype=np.float32).reshape(-1, 3),
+        "element": np.array([a["element"] for a in atoms], dtype=str),
+        "name": np.array([a["name"] for a in atoms], dtype=str),
+        "residue_name": np.array([a["residue_name"] for a in atoms], dtype=str),
+        "residue_number": np.array([a["residue_number"] for a in atoms], dtype=np.int32),
+        "chain_id": np.array([a["chain_id"] for a in atoms], dtype=str),
+    }
+
+
+def arrays_path(json_path):
+    return os.path.splitext(json_path)[0] + ".npz"
+
+
+def save_atom_arrays(json_path, atoms):
+    arrays = atoms if isinstance(atoms, dict) else atoms_to_arrays(atoms)
+    # Rebuilt lazily on the request path, so swap it in whole like dump_json;
+    # the temp name keeps .npz or np.savez would append one
+    path = arrays_path(json_path)
+    tmp = temp_path(path, ".tmp.npz")
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+@lru_cache(maxsize=32)
+def _load_arrays(npz_path, mtime):
+    with np.load(npz_path) as data:
+        arrays = {k: data[k] for k in data.files}
+    for arr in arrays.values():
+        arr.flags.writeable = False
+    return arrays
+
+
+def msgpack_path(json_path):
+    return os.path.splitext(json_path)[0] + ".msgpack"
+
+
+def save_molecule_msgpack(json_path, pdb_id, atoms, bonds):
+    """
+    Binary wire format for the viewer: numeric columns as little-endian
+    bytes (xyz float32 x3, residue_number int32, bonds uint32 pairs),
+    strings as plain arrays.
+    """
+    arrays = atoms if isinstance(atoms, dict) else atoms_to_arrays(atoms)
+    payload = {
+        "pdb_id": pdb_id,
+        "n_atoms": len(arrays["index"]),
+        "index": arrays["index"].astype("<i4").tobytes(),
+        "xyz": arrays["xyz"].astype("<f4").tobytes(),
+        "element": arrays["element"].tolist(),
+        "name": arrays["name"].tolist(),
+        "residue_name": arrays["residue_name"].tolist(),
+        "residue_number": arrays["residue_number"].astype("<i4").tobytes(),
+        "chain_id": arrays["chain_id"].tolist(),
+        "bonds": np.array([(b["a"], b["b"]) for b in bonds], dtype="<u4").tobytes(),
+        "bond_dist": np.array([b["dist"] for b in bonds], dtype="<f4").tobytes(),
+    }
+    path = msgpack_path(json_path)
+    tmp = temp_path(path)
+    with open(tmp, "wb") as f:
+        f.write(msgpack.packb(payload, use_bin_type=True))
+    os.replace(tmp, path)
+
+
+@lru_cache(maxsize=32)
+def _load_index_map(npz_path, mtime):
+    index = _load_arrays(npz_path, mtime)["index"]
+    return {idx: pos for pos, idx in enumerate(index.tolist())}
+
+
+def load_atom_arrays(json_path):
+    """SoA arrays for a molecule JSON, (re)building the .npz sidecar when missing or stale."""
+    npz_path = arrays_path(json_path)
+    if not os.path.exists(npz_path) or os.path.getmtime(npz_path) < os.path.getmtime(json_path):
+        save_atom_arrays(json_path, load_atoms_from_json(json_path))
+    return _load_arrays(npz_path, os.path.getmtime(npz_path))
+
+
+def load_atom_index(json_path):
+    """SoA arrays plus an {atom index: row} map for O(1) lookups."""
+    arrays = load_atom_arrays(json_path)
+    npz_path = arrays_path(json_path)
+    return arrays, _load_index_map(npz_path, os.path.getmtime(npz_path))
 
 
 def calculate_phi_psi(path):
-    parser = PDBParser(QUIET=True)
-    structure = parser.get_structure("prot", path)
+    structure = load_structure(path)
     ppb = PPBuilder()
     
     phi_psi_data = []
     
     for pp in ppb.build_peptides(structure):
-        phi_psi = pp.get_phi_psi_list()
-        for i, (phi, psi) in enumerate(phi_psi):
+        # Missing angles (chain ends) become NaN and are masked out in one go
+        raw = np.array(pp.get_phi_psi_list(), dtype=np.float64)
+        deg = np.degrees(raw)
+        valid = np.nonzero(~np.isnan(deg).any(axis=1))[0]
+
+        for i, (phi_deg, psi_deg) in zip(valid.tolist(), deg[valid].tolist()):
             res = pp[i]
-            phi_deg = math.degrees(phi) if phi is not None else None
-            psi_deg = math.degrees(psi) if psi is not None else None
-            
-            if phi_deg is not None and psi_deg is not None:
-                phi_psi_data.append({
-                    "residue_name": res.get_resname(),
-                    "residue_number": res.get_id()[1],
-                    "chain_id": res.get_parent().get_id(),
-                    "phi": phi_deg,
-                    "psi": psi_deg
-                })
+            phi_psi_data.append({
+                "residue_name": res.get_resname(),
+                "residue_number": res.get_id()[1],
+                "chain_id": res.get_parent().get_id(),
+                "phi": phi_deg,
+                "psi": psi_deg
+            })
                 
     return phi_psi_data
 
 
 def calculate_contact_map(path):
-    parser = PDBParser(QUIET=True)
-    structure = parser.get_structure("prot", path)
-    
-    residues = list(structure.get_residues())
-    n = len(residues)
-    
+    arrays = parse_pdb_arrays(path)
+
+    # One CA per residue (atom names are unique within a residue)
+    rows = np.nonzero(arrays["name"] == "CA")[0]
+    if not len(rows):
+        return []
+    res_nums = arrays["residue_number"][rows].tolist()
+    res_names = arrays["residue_name"][rows].tolist()
+
+    # Only CA pairs within the cutoff, from one KD-tree query, in row-major order
+    ca = arrays["xyz"][rows].astype(np.float64)
+    pairs = cKDTree(ca).query_pairs(r=12.0, output_type="ndarray")
+    diff = ca[pairs[:, 0]] - ca[pairs[:, 1]]
+    diff *= diff
+    d = np.sqrt(diff[:, 0] + diff[:, 1] + diff[:, 2])
+    keep = d < 12.0 # Cutoff for contact map visualization
+    pairs, d = pairs[keep], d[keep]
+    order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+    ii, jj, d = pairs[order, 0], pairs[order, 1], d[order]
+
     # Better format for frontend heatmap: list of {x: res_num, y: res_num, value: dist}
     data = []
-    for i, r1 in enumerate(residues):
-        if "CA" not in r1: continue
-        for j, r2 in enumerate(residues):
-            if i >= j: continue # Symmetric
-            if "CA" not in r2: continue
-            
-            dist = r1["CA"] - r2["CA"]
-            if dist < 12.0: # Cutoff for contact map visualization
-                data.append({
-                    "x": r1.get_id()[1],
-                    "y": r2.get_id()[1],
-                    "value": round(dist, 2),
-                    "res_x": r1.get_resname(),
-                    "res_y": r2.get_resname()
-                })
+    for i, j, d in zip(ii.tolist(), jj.tolist(), d.tolist()):
+        data.append({
+            "x": res_nums[i],
+            "y": res_nums[j],
+            "value": round(d, 2),
+            "res_x": res_names[i],
+            "res_y": res_names[j]
+        })
                 
     return data
 
 
 def get_sequence(path):
-    parser = PDBParser(QUIET=True)
-    structure = parser.get_structure("prot", path)
+    structure = load_structure(path)
     ppb = PPBuilder()
     
     seq_data = []
@@ -1,8 +1,14 @@
 import os, math
 import numpy as np
 from scipy.spatial import Delaunay, cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from collections import defaultdict
 
+# Bump whenever Scientific_Pockets' output changes: saved results are keyed
+# on it, so results from an older algorithm are never served again
+POCKETS_VERSION = 2
+
 # --- HYDROPHOBICITY SCALE (Kyte–Doolittle) ---
 KD = {
     'A':1.8,'R':-4.5,'N':-3.5,'D':-3.5,'C':2.5,
@@ -23,21 +29,19 @@ AA3 = {
 def load_atoms(obj):
     """Accepts mol['atoms'] OR a PDB file path."""
     if isinstance(obj, str) and obj.lower().endswith(".pdb"):
+        from pdb_utils import parse_pdb_arrays
+        arrays = parse_pdb_arrays(obj)
         atoms = []
         residues = defaultdict(list)
-        with open(obj) as f:
-            for line in f:
-                if line.startswith(("ATOM  ","HETATM")):
-                    x=float(line[30:38]); y=float(line[38:46]); z=float(line[46:54])
-                    res=line[17:20].strip()
-                    chain=line[21].strip() or "_"
-                    num=int(line[22:26])
-                    idx=len(atoms)
-                    atoms.append({
-                        "x":x,"y":y,"z":z,
-                        "resname":res,"chain":chain,"resseq":num
-                    })
-                    residues[(chain,num,res)].append(idx)
+        for idx, ((x,y,z), res, chain, num) in enumerate(zip(
+                arrays["xyz"].tolist(), arrays["residue_name"].tolist(),
+                arrays["chain_id"].tolist(), arrays["residue_number"].tolist())):
+            chain = chain.strip() or "_"
+            atoms.append({
+                "x":x,"y":y,"z":z,
+                "resname":res,"chain":chain,"resseq":num
+            })
+            residues[(chain,num,res)].append(idx)
         return atoms, residues
 
     # assume mol["atoms"]
@@ -48,40 +52,78 @@ def load_atoms(obj):
         residues[key].append(i)
     return atoms, residues
 
+def load_arrays(obj):
+    """Coords (N,3) + per-atom (chain, resseq, resname) keys.
+    Accepts SoA arrays (see pdb_utils.atoms_to_arrays), a molecule JSON path
+    (read via its .npz sidecar), a PDB path (pdb_utils.parse_pdb_arrays) OR mol['atoms']."""
+    if isinstance(obj, str) and obj.lower().endswith(".json"):
+        from pdb_utils import load_atom_arrays
+        obj = load_atom_arrays(obj)
+    elif isinstance(obj, str) and obj.lower().endswith(".pdb"):
+        from pdb_utils import parse_pdb_arrays
+        obj = parse_pdb_arrays(obj)
+
+    if isinstance(obj, dict) and "xyz" in obj:
+        coords = np.asarray(obj["xyz"], dtype=np.float64).reshape(-1,3)
+        keys = list(zip(
+            [c.strip() or "_" for c in obj["chain_id"].tolist()],
+            obj["residue_number"].tolist(),
+            obj["residue_name"].tolist()
+        ))
+        return coords, keys
+
+    atoms, _ = load_atoms(obj)
+    coords = np.array([[a["x"],a["y"],a["z"]] for a in atoms])
+    keys = [(a["chain"], a["resseq"], a["resname"]) for a in atoms]
+    return coords, keys
+
 # -------------------- ALPHA-SPHERE CALC --------------------
-def circumsphere(p):
-    p0=p[0]
-    A=2*(p[1:]-p0)
-    b=np.sum(p[1:]**2 - p0**2, axis=1)
-    try:
-        c=np.linalg.solve(A,b)
-        r=np.linalg.norm(c-p0)
-        return c,r
-    except:
-        return None,None
+def circumspheres(P):
+    """Centers (M,3) and radii (M,) for stacked tetrahedra P (M,4,3).
+    Degenerate (singular) simplices get NaN."""
+    p0=P[:,:1]
+    A=2*(P[:,1:]-p0)
+    b=np.sum(P[:,1:]**2 - p0**2, axis=2)
+    c=np.full((len(P),3), np.nan)
+    ok=np.linalg.det(A)!=0
+    if ok.any():
+        c[ok]=np.linalg.solve(A[ok], b[ok][...,None])[...,0]
+    r=np.linalg.norm(c-P[:,0], axis=1)
+    return c,r
 
 # ----------------------- CLUSTERING ------------------------
 def cluster(points, eps=4.0, min_pts=5):
+    """DBSCAN: core points (>= min_pts neighbours within eps, self included)
+    joined into connected components; clusters numbered by their lowest
+    core index; a border point joins the lowest-numbered adjacent cluster."""
     if len(points)==0: return np.array([])
-    tree = cKDTree(points)
-    labels = -1*np.ones(len(points),dtype=int)
-    cid=0
-    for i in range(len(points)):
-        if labels[i]!=-1: continue
-        nbrs = tree.query_ball_point(points[i], eps)
-        if len(nbrs) < min_pts:
-            labels[i] = -1
-            continue
-        stack=set(nbrs)
-        labels[i]=cid
-        while stack:
-            j=stack.pop()
-            if labels[j]!=-1: continue
-            labels[j]=cid
-            new = tree.query_ball_point(points[j], eps)
-            if len(new)>=min_pts:
-                stack.update(new)
-        cid+=1
+    n=len(points)
+    labels = -1*np.ones(n,dtype=int)
+    pairs = cKDTree(points).query_pairs(eps, output_type="ndarray")
+    core = np.bincount(pairs.ravel(), minlength=n)+1 >= min_pts
+    if not core.any():
+        return labels
+
+    # ---- core points: connected components of the core-core graph ----
+    cc = pairs[core[pairs[:,0]] & core[pairs[:,1]]]
+    graph = coo_matrix((np.ones(len(cc),dtype=np.int8),(cc[:,0],cc[:,1])),shape=(n,n))
+    _, comp = connected_components(graph, directed=False)
+    core_idx = np.nonzero(core)[0]
+    comps, first = np.unique(comp[core_idx], return_index=True)
+    cid_of = np.empty(comp.max()+1, dtype=int)
+    cid_of[comps[np.argsort(first)]] = np.arange(len(comps))
+    labels[core_idx] = cid_of[comp[core_idx]]
+
+    # ---- border points: lowest cluster id among adjacent core points ----
+    cb = pairs[core[pairs[:,0]] != core[pairs[:,1]]]
+    if len(cb):
+        is_core0 = core[cb[:,0]]
+        border = np.where(is_core0, cb[:,1], cb[:,0])
+        owner = labels[np.where(is_core0, cb[:,0], cb[:,1])]
+        best = np.full(n, n, dtype=int)
+        np.minimum.at(best, border, owner)
+        hit = best < n
+        labels[hit] = best[hit]
     return labels
 
 # ----------------------- VOLUME (ACCURATE) -----------------------
@@ -100,15 +142,12 @@ def voxel_volume(centers, radii, resolution=0.75):
     X,Y,Z=np.meshgrid(xs,ys,zs,indexing="ij")
     pts=np.vstack([X.ravel(),Y.ravel(),Z.ravel()]).T
 
-    vol=0
-    tree = cKDTree(centers)
-    for pt in pts:
-        idxs = tree.query_ball_point(pt, radii.max())
-        for i in idxs:
-            if np.linalg.norm(pt-centers[i]) <= radii[i]:
-                vol += resolution**3
-                break
-    return vol
+    # Invert the search: each sphere collects the voxels it covers (one
+    # batched, threaded query), and the volume is the size of their union
+    covered=np.zeros(len(pts),dtype=bool)
+    for idxs in cKDTree(pts).query_ball_point(centers, radii, workers=-1):
+        covered[idxs]=True
+    return float(covered.sum())*resolution**3
 
 # ---------------------- MAIN FUNCTION ----------------------
 def Scientific_Pockets(mol_or_pdb,
@@ -117,8 +156,7 @@ def Scientific_Pockets(mol_or_pdb,
                        eps=4.0,
                        min_samples=6):
     
-    atoms, residues = load_atoms(mol_or_pdb)
-    coords = np.array([[a["x"],a["y"],a["z"]] for a in atoms])
+    coords, res_keys = load_arrays(mol_or_pdb)
 
     if len(coords)<4:
         return {"error":"Too few atoms"}
@@ -128,25 +166,14 @@ def Scientific_Pockets(mol_or_pdb,
     except:
         return {"error": "Delaunay triangulation failed"}
 
-    centers=[]
-    radii=[]
-    simplex_ids=[]
-
-    for simp in tri.simplices:
-        p = coords[simp]
-        c,r = circumsphere(p)
-        if c is None or math.isnan(r): continue
-        if min_radius <= r <= max_radius:
-            centers.append(c)
-            radii.append(r)
-            simplex_ids.append(simp)
+    # all simplices in one batched solve; NaN radii fail the range test
+    centers,radii = circumspheres(coords[tri.simplices])
+    keep = (min_radius <= radii) & (radii <= max_radius)
+    centers,radii = centers[keep],radii[keep]
 
     if len(centers)==0:
         return {"pockets":[], "meta":{"alpha_spheres":0}}
 
-    centers=np.array(centers)
-    radii=np.array(radii)
-
     labels = cluster(centers, eps=eps, min_pts=min_samples)
 
     pockets=[]
@@ -161,13 +188,10 @@ def Scientific_Pockets(mol_or_pdb,
         pocket_center = sph.mean(axis=0)
 
         # ---- pocket residues ----
-        pocket_res=set()
-        for c in sph:
-            idxs = atom_tree.query_ball_point(c,4.5)
-            for idx in idxs:
-                a=atoms[idx]
-                key=(a["chain"], a["resseq"], a["resname"])
-                pocket_res.add(key)
+        # atoms near any sphere, from one batched (threaded) query
+        near = atom_tree.query_ball_point(sph, 4.5, workers=-1)
+        near = np.unique(np.concatenate([np.asarray(l, dtype=np.intp) for l in near]))
+        pocket_res={res_keys[idx] for idx in near.tolist()}
 
         # ---- hydrophobicity & polarity ----
         hydros=[]
@@ -186,10 +210,8 @@ def Scientific_Pockets(mol_or_pdb,
             polar_frac = polar/len(hydros)
 
         # ---- solvent exposure ----
-        counts=[]
-        for c in sph:
-            counts.append(len(atom_tree.query_ball_point(c,8.0)))
-        counts=np.array(counts)
+        # neighbour counts for every sphere in one batched C call
+        counts = atom_tree.query_ball_point(sph, 8.0, return_length=True, workers=-1)
         if counts.max()==counts.min(): 
             exposure=0
         else:
@@ -207,7 +229,7 @@ def Scientific_Pockets(mol_or_pdb,
 
         pockets.append({
             "id":int(pid),
-            "center":pocket_center.tolist(),
+            "center":pocket_center, # ndarray, encoded natively by orjson
             "n_spheres":int(len(sph)),
             "avg_sphere_radius":float(np.mean(rad)),
             "volume":float(vol),
@@ -226,4 +248,7 @@ def Scientific_Pockets(mol_or_pdb,
             "alpha_spheres":len(centers),
             "clusters":len(set(labels)) - (1 if -1 in labels else 0)
         }
-    }
\ No newline at end of file
+    }
+
+# The alpha-sphere detector is the only pocket detector
+detect_pockets = Scientific_Pockets
\ No newline at end of file
@@ -0,0 +1,17 @@
+#!/usr/bin/env sh
+# Production launch: one worker per core on uvloop + httptools.
+# Workers share job state through backend_jobs/jobs.db.
+cd "$(dirname "$0")" || exit 1
+
+# nproc is GNU-only; getconf works on Linux and macOS alike
+WORKERS="${WORKERS:-$(getconf _NPROCESSORS_ONLN 2>/dev/null || python3 -c 'import os; print(os.cpu_count())')}"
+# main.py splits the cores between the workers' analysis pools
+export BACKEND_WORKERS="$WORKERS"
+
+exec uvicorn main:app \
+    --host "${HOST:-0.0.0.0}" \
+    --port "${PORT:-8000}" \
+    --workers "$WORKERS" \
+    --loop uvloop \
+    --http httptools \
+    --no-access-log
@@ -1,6 +1,9 @@
 # sequence_validator.py
 
-VALID_AA = set("ACDEFGHIKLMNPQRSTVWY")  # 20 canonical one-letter codes
+VALID_AA = frozenset("ACDEFGHIKLMNPQRSTVWY")  # 20 canonical one-letter codes
+_ALLOWED_STR = "".join(sorted(VALID_AA))
+
+_VALID_BYTES = _ALLOWED_STR.encode("ascii")
 
 def validate_protein_sequence(seq: str):
     """
@@ -19,25 +22,33 @@ def validate_protein_sequence(seq: str):
     if seq.startswith(">"):
         raise ValueError("FASTA headers are not allowed. Provide the raw sequence only.")
 
+    # Reject an oversized paste before scanning or copying it. upper() never
+    # shortens a string, so anything too long here is too long after it too
+    if len(seq) > 2000:
+        raise ValueError("Sequence too long. Maximum allowed is 2000 amino acids.")
+
     # Remove internal spaces (NOT allowed)
     if " " in seq:
         raise ValueError("Sequence contains spaces. Provide a continuous string of amino acids.")
 
-    # Must be uppercase; convert if user input is lowercase
-    seq = seq.upper()
-
-    # Check characters
-    bad = [c for c in seq if c not in VALID_AA]
-    if bad:
-        raise ValueError(
-            f"Invalid amino acids found: {' '.join(bad)}. "
-            f"Allowed: {''.join(sorted(VALID_AA))}"
-        )
+    # Must be uppercase; convert if user input is lowercase (isupper() stops
+    # at the first lowercase char and saves the copy in the common case)
+    if not seq.isupper():
+        seq = seq.upper()
 
-    # Length constraints to prevent abuse
+    # Exact length constraints, after upper() (which can expand, e.g. ß -> SS)
     if len(seq) < 10:
         raise ValueError("Sequence too short. Must be at least 10 amino acids.")
     if len(seq) > 2000:
         raise ValueError("Sequence too long. Maximum allowed is 2000 amino acids.")
 
+    # Check characters: deleting every valid code in one C-level
+    # bytes.translate pass leaves nothing behind iff the sequence is valid
+    if not seq.isascii() or seq.encode("ascii").translate(None, _VALID_BYTES):
+        bad = sorted(frozenset(seq).difference(VALID_AA))
+        raise ValueError(
+            f"Invalid amino acids found: {' '.join(bad)}. "
+            f"Allowed: {_ALLOWED_STR}"
+        )
+
     return seq
\ No newline at end of file
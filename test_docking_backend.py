@@ -1,74 +1,111 @@
-import urllib.request
+import http.client
+import urllib.error
 import urllib.parse
 import json
 import time
 import os
+import mmap
+import contextlib
 import sys
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+import functools
 
-BASE_URL = "http://localhost:8000"
+HOST = "localhost"
+PORT = 8000
 INPUTS_DIR = "inputs"
 PDB_FILE = os.path.join(INPUTS_DIR, "1CRN.pdb")
 LIGAND_FILE = os.path.join(INPUTS_DIR, "lig.sdf")
+MAX_PARALLEL_DOCKS = 4
+# Socket timeout: blocked reads wait on fd readiness (poll) for at most this
+# long. Must exceed the 120 s /wait long-poll so that isn't cut short
+HTTP_TIMEOUT = 150
+# Overall time allowed for one docking run to finish
+DOCK_TIMEOUT = 600
+WAIT_SLICE = 120  # longest single /wait request, below HTTP_TIMEOUT
 
-def multipart_post(url, fields, files):
-    boundary = '---BOUNDARY---'
-    body = []
+# Multipart framing, encoded once at import rather than per part
+BOUNDARY = '---BOUNDARY---'
+_BOUNDARY_LINE = b'--%s\r\n' % BOUNDARY.encode()
+_CLOSING_LINE = b'--%s--\r\n' % BOUNDARY.encode()
+_FIELD_HEADER = b'Content-Disposition: form-data; name="%b"\r\n\r\n'
+_FILE_HEADER = b'Content-Disposition: form-data; name="%b"; filename="%b"\r\nContent-Type: %b\r\n\r\n'
+_CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
 
+@functools.lru_cache(maxsize=64)
+def _guess_mime(ext):
+    return mimetypes.guess_type("x" + ext)[0] or 'application/octet-stream'
+
+def request(conn, method, path, body=None, headers=None):
+    """Send one request over the shared keep-alive connection, return the body."""
+    headers = {"Connection": "keep-alive", **(headers or {})}
+    for attempt in range(2):
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+            break
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # Server closed the idle connection; reconnect once
+            conn.close()
+            if attempt:
+                raise
+    if resp.status >= 400:
+        raise urllib.error.HTTPError(path, resp.status, resp.reason, resp.headers, None)
+    return data
+
+def get_json(conn, path):
+    return json.loads(request(conn, "GET", path))
+
+def multipart_post(conn, path, fields, files):
+    # Construct full body: collect the parts, join once
+    parts = []
     for key, value in fields.items():
-        body.append(f'--{boundary}')
-        body.append(f'Content-Disposition: form-data; name="{key}"')
-        body.append('')
-        body.append(str(value))
-
-    for key, filepath in files.items():
-        filename = os.path.basename(filepath)
-        mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
-        with open(filepath, 'rb') as f:
-            file_content = f.read()
-        
-        body.append(f'--{boundary}')
-        body.append(f'Content-Disposition: form-data; name="{key}"; filename="{filename}"')
-        body.append(f'Content-Type: {mime_type}')
-        body.append('')
-        # We need to append bytes, so we handle this differently below
-        pass
-
-    # Construct full body
-    final_body = b""
-    for key, value in fields.items():
-        final_body += f'--{boundary}\r\n'.encode()
-        final_body += f'Content-Disposition: form-data; name="{key}"\r\n\r\n'.encode()
-        final_body += f'{value}\r\n'.encode()
+        parts.append(_BOUNDARY_LINE)
+        parts.append(_FIELD_HEADER % key.encode())
+        parts.append(f'{value}\r\n'.encode())
     
-    for key, filepath in files.items():
-        filename = os.path.basename(filepath)
-        mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
-        with open(filepath, 'rb') as f:
-            file_content = f.read()
-        
-        final_body += f'--{boundary}\r\n'.encode()
-        final_body += f'Content-Disposition: form-data; name="{key}"; filename="{filename}"\r\n'.encode()
-        final_body += f'Content-Type: {mime_type}\r\n\r\n'.encode()
-        final_body += file_content
-        final_body += b'\r\n'
+    # Files are memory-mapped rather than read(): join() copies them straight
+    # from the page cache, so each file is held in memory once, not twice
+    with contextlib.ExitStack() as stack:
+        for key, filepath in files.items():
+            filename = os.path.basename(filepath)
+            mime_type = _guess_mime(os.path.splitext(filename)[1].lower())
+            f = stack.enter_context(open(filepath, 'rb'))
+            if os.fstat(f.fileno()).st_size:
+                file_content = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            else:
+                file_content = b''  # empty files cannot be mapped
+            
+            parts.append(_BOUNDARY_LINE)
+            parts.append(_FILE_HEADER % (key.encode(), filename.encode(), mime_type.encode()))
+            parts.append(file_content)
+            parts.append(b'\r\n')
 
-    final_body += f'--{boundary}--\r\n'.encode()
+        parts.append(_CLOSING_LINE)
+        final_body = b"".join(parts)
 
-    req = urllib.request.Request(url, data=final_body)
-    req.add_header('Content-Type', f'multipart/form-data; boundary={boundary}')
-    return urllib.request.urlopen(req)
+    # Fixed length up front: the server reads one sized body, never chunks
+    headers = {'Content-Type': _CONTENT_TYPE, 'Content-Length': str(len(final_body))}
+    return request(conn, "POST", path, final_body, headers)
 
-def test_docking_flow():
-    print(f"Starting Backend Test (urllib)...")
+def test_docking_flow(ligands=(LIGAND_FILE,)):
+    print(f"Starting Backend Test (http.client)...")
     print(f"Using PDB: {PDB_FILE}")
-    print(f"Using Ligand: {LIGAND_FILE}")
+    print(f"Using Ligand: {', '.join(ligands)}")
+
+    # One connection for the whole flow instead of a new one per request
+    conn = http.client.HTTPConnection(HOST, PORT, timeout=HTTP_TIMEOUT)
+    try:
+        run_flow(conn, ligands)
+    finally:
+        conn.close()
 
+def run_flow(conn, ligands):
     # 1. Upload PDB
     print("\n[1] Uploading PDB...")
     try:
-        resp = multipart_post(f"{BASE_URL}/upload_pdb", {}, {"file": PDB_FILE})
-        data = json.loads(resp.read().decode())
+        data = json.loads(multipart_post(conn, "/upload_pdb", {}, {"file": PDB_FILE}))
         job_id = data["job_id"]
         pdb_id = data["pdb_id"]
         print(f"SUCCESS: Job ID: {job_id}, PDB ID: {pdb_id}")
@@ -79,10 +116,16 @@ def test_docking_flow():
     # 2. Detect Pockets
     print("\n[2] Detecting Pockets...")
     try:
-        data = urllib.parse.urlencode({"pdb_id": pdb_id}).encode()
-        req = urllib.request.Request(f"{BASE_URL}/job/{job_id}/detect_pockets", data=data)
-        resp = urllib.request.urlopen(req)
-        pockets_data = json.loads(resp.read().decode())
+        # PDB ids are plain alphanumerics, so the form body needs no escaping;
+        # anything else (e.g. a filename-derived id) still goes through urlencode
+        if pdb_id.isascii() and pdb_id.isalnum():
+            data = f"pdb_id={pdb_id}".encode("ascii")
+        else:
+            data = urllib.parse.urlencode({"pdb_id": pdb_id}).encode()
+        pockets_data = json.loads(request(
+            conn, "POST", f"/job/{job_id}/detect_pockets", data,
+            {"Content-Type": "application/x-www-form-urlencoded"}
+        ))
         pockets = pockets_data.get("pockets", [])
         
         if not pockets:
@@ -96,63 +139,109 @@ def test_docking_flow():
         print(f"FAILED: Pocket detection failed {e}")
         return
 
-    # 3. Start Docking
-    print("\n[3] Starting Docking...")
     pocket_json = json.dumps(target_pocket)
+    if len(ligands) == 1:
+        dock_ligand(conn, job_id, pdb_id, pocket_json, ligands[0])
+        return
+
+    # Several ligands: dock them concurrently so one run's upload and wait
+    # don't hold up the next. http.client connections aren't thread-safe,
+    # so each task gets its own
+    def dock_one(ligand):
+        c = http.client.HTTPConnection(HOST, PORT, timeout=HTTP_TIMEOUT)
+        try:
+            dock_ligand(c, job_id, pdb_id, pocket_json, ligand, f"{os.path.basename(ligand)}: ")
+        finally:
+            c.close()
+
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_DOCKS, len(ligands))) as ex:
+        list(ex.map(dock_one, ligands))
+
+def dock_ligand(conn, job_id, pdb_id, pocket_json, ligand, tag=""):
+    # 3. Start Docking
+    print(f"\n{tag}[3] Starting Docking...")
     try:
-        resp = multipart_post(
-            f"{BASE_URL}/job/{job_id}/start_docking", 
+        dock_data = json.loads(multipart_post(
+            conn,
+            f"/job/{job_id}/start_docking", 
             {"receptor_pdb_id": pdb_id, "pocket_data": pocket_json}, 
-            {"ligand_file": LIGAND_FILE}
-        )
-        dock_data = json.loads(resp.read().decode())
+            {"ligand_file": ligand}
+        ))
         docking_id = dock_data["docking_id"]
-        print(f"SUCCESS: Docking queued. ID: {docking_id}")
+        print(f"{tag}SUCCESS: Docking queued. ID: {docking_id}")
     except Exception as e:
-        print(f"FAILED: Docking start failed {e}")
+        print(f"{tag}FAILED: Docking start failed {e}")
         # print error body if possible
         return
 
-    # 4. Poll for Results
-    print("\n[4] Polling for Results...")
-    max_retries = 60
-    for i in range(max_retries):
+    # 4. Wait for Results
+    print(f"\n{tag}[4] Waiting for Results...")
+    # Each /wait blocks up to WAIT_SLICE s and answers {"status": "pending"} (202)
+    # if the run is still going; wait again until the overall budget is spent
+    deadline = time.monotonic() + DOCK_TIMEOUT
+    try:
+        while True:
+            remaining = max(int(deadline - time.monotonic()), 0)
+            result = get_json(conn, f"/job/{job_id}/docking/{docking_id}/wait?timeout={min(remaining, WAIT_SLICE)}")
+            if result.get("status") != "pending":
+                report_result(result, tag)
+                return
+            if remaining <= 0:
+                print(f"{tag}FAILED: Timeout waiting for docking.")
+                return
+            print(f"{tag}Wait: still running")
+    except urllib.error.HTTPError as e:
+        # Servers without /wait answer 404 (unknown route) or 501
+        if e.code not in (404, 501):
+            print(f"{tag}Wait: Error {e}")
+            return
+        print(f"{tag}Wait: {e.code}, falling back to polling")
+    except Exception as e:
+        print(f"{tag}Wait: Error {e}, falling back to polling")
+
+    # Poll with exponential backoff (0.1, 0.2, 0.4 ... 2.0 s), same overall budget
+    delay = 0.1
+    i = 0
+    while time.monotonic() < deadline:
+        i += 1
         try:
-            with urllib.request.urlopen(f"{BASE_URL}/job/{job_id}/docking/{docking_id}/result") as resp:
-                result = json.loads(resp.read().decode())
-                status = result.get("status")
-                print(f"Poll {i+1}: {status}")
-                
-                if status == "done":
-                    print("\n[5] Docking Completed!")
-                    print(f"Best Energy: {result.get('best_energy')} kcal/mol")
-                    print(f"Output PDB: {result.get('output_pdb')}")
-                    
-                    if result.get("output_pdb"):
-                        print("SUCCESS: out.pdb generated.")
-                    else:
-                        print("FAILED: out.pdb NOT generated.")
-                    
-                    if result.get("best_energy") is not None and result.get("best_energy") != 0.0:
-                         print("SUCCESS: Energy parsed.")
-                    else:
-                         print("WARNING: Energy is 0.0 or None.")
-                    return
-                
-                if status == "error":
-                    print(f"FAILED: Docking job failed with error: {result.get('error')}")
-                    return
+            result = get_json(conn, f"/job/{job_id}/docking/{docking_id}/result")
+            print(f"{tag}Poll {i}: {result.get('status')}")
+            if result.get("status") in ("done", "error"):
+                report_result(result, tag)
+                return
         except urllib.error.HTTPError as e:
             if e.code == 404:
-                print(f"Poll {i+1}: Not ready (404)")
+                print(f"{tag}Poll {i}: Not ready (404)")
             else:
-                 print(f"Poll {i+1}: Error {e}")
+                 print(f"{tag}Poll {i}: Error {e}")
         except Exception as e:
-            print(f"Poll {i+1}: Error {e}")
-        
-        time.sleep(2)
+            print(f"{tag}Poll {i}: Error {e}")
+
+        time.sleep(delay)
+        delay = min(delay * 2, 2.0)
+
+    print(f"{tag}FAILED: Timeout waiting for docking.")
+
+def report_result(result, tag=""):
+    status = result.get("status")
+    if status == "error":
+        print(f"{tag}FAILED: Docking job failed with error: {result.get('error')}")
+        return
+
+    print(f"\n{tag}[5] Docking Completed!")
+    print(f"{tag}Best Energy: {result.get('best_energy')} kcal/mol")
+    print(f"{tag}Output PDB: {result.get('output_pdb')}")
+    
+    if result.get("output_pdb"):
+        print(f"{tag}SUCCESS: out.pdb generated.")
+    else:
+        print(f"{tag}FAILED: out.pdb NOT generated.")
     
-    print("FAILED: Timeout waiting for docking.")
+    if result.get("best_energy") is not None and result.get("best_energy") != 0.0:
+         print(f"{tag}SUCCESS: Energy parsed.")
+    else:
+         print(f"{tag}WARNING: Energy is 0.0 or None.")
 
 if __name__ == "__main__":
-    test_docking_flow()
+    test_docking_flow(sys.argv[1:] or [LIGAND_FILE])